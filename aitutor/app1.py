@@ -1,20 +1,126 @@
 import streamlit as st
 import json
 import os
-from typing import Dict, Any
-import tempfile
+from typing import List, Tuple
 from pathlib import Path
-import time
-import plotly.graph_objects as go
-import plotly.express as px
+import queue
+import threading
+import atexit
+import copy
 import hashlib
+import hmac
+import html
 import datetime
+import sqlite3
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 # Import your existing modules
 from main import RAGAssistant
 from config import config
 
+# Static page styles live in styles/*.css. Streamlit drops any element that a
+# rerun does not re-emit, so these are still sent on every run of their page,
+# but the files are read once per process rather than on every script rerun.
+_STYLES_DIR = Path(__file__).resolve().parent / "styles"
+
+@st.cache_data(show_spinner=False)
+def _page_css(name: str) -> str:
+    """Read a stylesheet once and wrap it for st.markdown."""
+    return f"<style>\n{(_STYLES_DIR / f'{name}.css').read_text(encoding='utf-8')}</style>"
+
+_FEATURE_TMPL = (
+    '<div class="feature-item">'
+    '<div class="feature-icon">{icon}</div>'
+    '<div><strong style="color: #667eea;">{title}</strong><br>'
+    '<small style="color: #666;">{description}</small></div>'
+    '</div>'
+)
+
+_FEATURES = [
+    ("🧠", "AI-Powered Learning", "Get personalized explanations and insights"),
+    ("📚", "Smart Document Processing", "Upload and analyze any study material"),
+    ("🎯", "Interactive Quizzes", "Test your knowledge with auto-generated questions"),
+    ("📊", "Progress Tracking", "Monitor your learning journey and achievements"),
+    ("💬", "24/7 AI Tutor", "Ask questions anytime, get instant answers"),
+    ("🏆", "Gamified Learning", "Earn streaks and celebrate milestones")
+]
+
+# All feature cards rendered as one block so the page sends a single element
+_FEATURES_HTML = "".join(
+    _FEATURE_TMPL.format(icon=icon, title=title, description=description)
+    for icon, title, description in _FEATURES
+)
+
+_HEADER_TMPL = (
+    '<div class="main-header">'
+    '<h1>🎓 Welcome back, {username}!</h1>'
+    '<p>{welcome_subtitle}</p>'
+    '</div>'
+)
+
+_PROFILE_TMPL = (
+    '<div class="sidebar-section">'
+    '<h3 style="text-align: center; color: #667eea; margin-bottom: 1rem;">👋 Hello, {username}!</h3>'
+    '<p style="text-align: center; color: #666; font-size: 0.9rem;">Ready to learn something new today?</p>'
+    '<div style="background: linear-gradient(135deg, #e3f2fd 0%, #bbdefb 100%); padding: 0.8rem; border-radius: 8px; margin-top: 1rem;">'
+    '<p style="margin: 0; font-size: 0.85rem; color: #1976d2;">'
+    '<strong>🎓 Level:</strong> {student_class}<br>'
+    '<strong>🎯 Goal:</strong> {learning_goal}'
+    '</p>'
+    '</div>'
+    '</div>'
+)
+
+_QUIZ_QUESTION_TMPL = (
+    '<div class="quiz-question">'
+    '<h4 style="color: #000000;">📝 Question {number}</h4>'
+    '<p><strong style="color: #000000;">{question}</strong></p>'
+    '</div>'
+)
+
+# Chunks shuffled into a quiz's question queue before it is refilled
+_QUIZ_QUEUE_SIZE = 50
+
+# Only the most recent exchanges are rendered; the full history stays in session state
+_CHAT_HISTORY_WINDOW = 20
+
+_USER_AVATAR = "🧑‍🎓"
+_BOT_AVATAR = "🤖"
+
+def _render_chat_history(chat_history: List[Tuple[str, str]]):
+    """Render the recent chat history with native chat message elements."""
+    for user_msg, bot_msg in chat_history[-_CHAT_HISTORY_WINDOW:]:
+        with st.chat_message("user", avatar=_USER_AVATAR):
+            st.markdown(user_msg)
+        with st.chat_message("assistant", avatar=_BOT_AVATAR):
+            st.markdown(bot_msg)
+
+# Session state defaults, split by whether they are needed before login
+_AUTH_DEFAULTS = {
+    'logged_in': False,
+    'auth_page': "signup",
+}
+
+_SESSION_DEFAULTS = {
+    'chat_history': [],
+    # Exchanges from this session only; the restored chat_history is display-only
+    'session_turns': [],
+    'quiz_active': False,
+    'current_question': None,
+    'quiz_score': {'correct': 0, 'total': 0},
+    'study_streak': 0,
+    'total_questions_answered': 0,
+}
+
+def _init_session_state(defaults: dict):
+    """Fill in any missing session state keys from a defaults table."""
+    for key, value in defaults.items():
+        if key not in st.session_state:
+            # Copy so sessions never share the mutable list/dict defaults
+            st.session_state[key] = copy.deepcopy(value)
+
 @dataclass
 class User:
     username: str
@@ -24,6 +130,11 @@ class User:
     study_streak: int = 0
     total_questions: int = 0
 
+@st.cache_resource(show_spinner="🔄 Loading your AI tutor...")
+def get_rag_assistant() -> RAGAssistant:
+    """Build the RAG assistant once per server process and reuse it across reruns."""
+    return RAGAssistant()
+
 class StreamlitRAGInterface:
     """Streamlit interface for the RAG Assistant."""
     
@@ -31,44 +142,156 @@ class StreamlitRAGInterface:
         self.assistant = None
         
     def initialize_assistant(self):
-        """Initialize the RAG assistant if not already done."""
-        if self.assistant is None:
-            try:
-                self.assistant = RAGAssistant()
-                return True
-            except Exception as e:
-                st.error(f"Failed to initialize assistant: {str(e)}")
-                return False
-        return True
+        """Attach the process-wide RAG assistant, building it on first use."""
+        try:
+            # The cache_resource lookup is cheap, so always defer to it rather than
+            # pinning a per-session copy that could outlive a cache clear
+            self.assistant = get_rag_assistant()
+            return True
+        except Exception as e:
+            st.error(f"Failed to initialize assistant: {str(e)}")
+            return False
 
 class AuthSystem:
     """Handle user authentication and management."""
     
+    HASH_PREFIX = "pbkdf2_sha256"
+    HASH_ITERATIONS = 200_000
+    VERIFIED_CACHE_SIZE = 1024
+    
     def __init__(self):
         self.users_file = "users.json"
+        self._last_saved = None
+        self._dummy_hash = None
+        # Async saves: a daemon writer drains _save_queue; sequence numbers keep writes in order
+        self._save_queue = queue.Queue()
+        self._save_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._save_seq = 0
+        self._written_seq = 0
+        self._writer = None
+        # Guards every users / _password_hashes mutation and the snapshots taken of them
+        self._users_lock = threading.RLock()
+        # Recently verified (username, stored hash, password MAC) triples; the MAC key
+        # lives only in this process so the cache never holds a guessable password digest
+        self._verified = OrderedDict()
+        self._verified_key = os.urandom(32)
+        self._verified_lock = threading.Lock()
         self.load_users()
     
     def load_users(self):
         """Load users from JSON file."""
         try:
             if os.path.exists(self.users_file):
-                with open(self.users_file, 'r') as f:
-                    self.users = json.load(f)
+                # json.loads takes the raw bytes, so skip the text-mode decode layer
+                with open(self.users_file, 'rb') as f:
+                    self.users = json.loads(f.read())
             else:
                 self.users = {}
         except:
             self.users = {}
+        
+        # Flat username -> hash index so logins never touch the nested profile dicts
+        self._password_hashes = {
+            username: data["password_hash"]
+            for username, data in self.users.items()
+            if "password_hash" in data
+        }
+    
+    def _store_user(self, username: str, user_data: dict):
+        """Store a user record and keep the password hash index in sync."""
+        with self._users_lock:
+            self.users[username] = user_data
+            self._password_hashes[username] = user_data["password_hash"]
+    
+    def update_user(self, username: str, fields: dict) -> bool:
+        """Update fields on an existing user record."""
+        with self._users_lock:
+            if username not in self.users:
+                return False
+            self.users[username].update(fields)
+            return True
     
     def save_users(self):
         """Save users to JSON file."""
-        with open(self.users_file, 'w') as f:
-            json.dump(self.users, f, indent=2)
+        self._write_payload(self._snapshot())
+    
+    def save_users_async(self):
+        """Queue a save of the current users and return without waiting for the disk."""
+        # Serialize now so later in-memory edits can't leak into this snapshot
+        self._save_queue.put(self._snapshot())
+        with self._save_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name="users-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush_saves)
+    
+    def flush_saves(self):
+        """Write out any queued save synchronously."""
+        latest = None
+        while True:
+            try:
+                latest = self._save_queue.get_nowait()
+            except queue.Empty:
+                break
+        if latest is not None:
+            self._write_payload(latest)
+    
+    def _snapshot(self) -> Tuple[int, str]:
+        """Serialize the users dict, tagged with a sequence number to order writes."""
+        # Held across the dump so no session can resize or edit a profile mid-serialize
+        with self._users_lock:
+            self._save_seq += 1
+            return self._save_seq, json.dumps(self.users, separators=(',', ':'))
+    
+    def _writer_loop(self):
+        """Background writer: coalesce queued saves and only write the newest."""
+        while True:
+            latest = self._save_queue.get()
+            while True:
+                try:
+                    latest = self._save_queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write_payload(latest)
+            except OSError as e:
+                print(f"⚠️ Failed to save users: {e}")
+    
+    def _write_payload(self, snapshot: Tuple[int, str]):
+        """Write a serialized snapshot unless a newer or identical one is already on disk."""
+        seq, payload = snapshot
+        with self._write_lock:
+            if seq <= self._written_seq:
+                return  # A newer snapshot was already written
+            self._written_seq = seq
+            if payload == self._last_saved:
+                return  # Nothing changed since the last write
+            
+            # Write to a temp file and swap it in so a crash never leaves a truncated users.json
+            tmp_file = f"{self.users_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                f.write(payload)
+            os.replace(tmp_file, self.users_file)
+            self._last_saved = payload
     
     def hash_password(self, password: str) -> str:
-        """Hash password using SHA256."""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash password using salted PBKDF2-SHA256."""
+        salt = os.urandom(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, self.HASH_ITERATIONS)
+        return f"{self.HASH_PREFIX}${self.HASH_ITERATIONS}${salt.hex()}${digest.hex()}"
+    
+    def verify_password(self, password: str, stored_hash: str) -> bool:
+        """Check a password against a stored PBKDF2 or legacy SHA256 hash."""
+        if stored_hash.startswith(f"{self.HASH_PREFIX}$"):
+            _, iterations, salt, expected = stored_hash.split("$")
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+            return hmac.compare_digest(digest, bytes.fromhex(expected))
+        # Accounts created before the PBKDF2 switch store an unsalted SHA256 hex digest
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
     
-    def register_user(self, username: str, email: str, password: str, user_prefs: dict = None) -> bool:
+    def register_user(self, username: str, email: str, password: str, user_prefs: dict = None,
+                      created_at: str = None) -> bool:
         """Register a new user."""
         if username in self.users:
             return False
@@ -77,7 +300,7 @@ class AuthSystem:
             "username": username,
             "email": email,
             "password_hash": self.hash_password(password),
-            "created_at": datetime.datetime.now().isoformat(),
+            "created_at": created_at or datetime.datetime.now().isoformat(),
             "study_streak": 0,
             "total_questions": 0
         }
@@ -86,108 +309,136 @@ class AuthSystem:
         if user_prefs:
             user_data.update(user_prefs)
         
-        self.users[username] = user_data
+        with self._users_lock:
+            # Re-check: another session may have taken the name while we hashed
+            if username in self.users:
+                return False
+            self._store_user(username, user_data)
         self.save_users()
         return True
     
     def authenticate_user(self, username: str, password: str) -> bool:
         """Authenticate user login."""
-        if username in self.users:
-            return self.users[username]["password_hash"] == self.hash_password(password)
-        return False
+        stored_hash = self._password_hashes.get(username)
+        if stored_hash is None:
+            # Spend the same hashing time as a real account so missing usernames can't be timed
+            with self._users_lock:
+                if self._dummy_hash is None:
+                    self._dummy_hash = self.hash_password(os.urandom(16).hex())
+            self.verify_password(password, self._dummy_hash)
+            return False
+        
+        password_mac = hmac.new(self._verified_key, password.encode(), hashlib.sha256).digest()
+        
+        # Login form reruns re-submit the same credentials; skip the slow hash for those
+        with self._verified_lock:
+            if (username, stored_hash, password_mac) in self._verified:
+                self._verified.move_to_end((username, stored_hash, password_mac))
+                return True
+        
+        if not self.verify_password(password, stored_hash):
+            return False
+        
+        if not stored_hash.startswith(f"{self.HASH_PREFIX}$"):
+            # Upgrade legacy SHA256 hashes on the first successful login
+            stored_hash = self.hash_password(password)
+            with self._users_lock:
+                self.users[username]["password_hash"] = stored_hash
+                self._password_hashes[username] = stored_hash
+            self.save_users()
+        
+        with self._verified_lock:
+            self._verified[(username, stored_hash, password_mac)] = True
+            if len(self._verified) > self.VERIFIED_CACHE_SIZE:
+                self._verified.popitem(last=False)
+        return True
     
     def get_user(self, username: str) -> dict:
-        """Get user data."""
-        return self.users.get(username, {})
+        """Get a copy of the user data, safe to keep in a session."""
+        with self._users_lock:
+            return copy.deepcopy(self.users.get(username, {}))
 
-def show_signup_page():
-    """Display the beautiful sign-up page."""
-    st.markdown("""
-    <style>
-    .signup-container {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 3rem;
-        border-radius: 20px;
-        box-shadow: 0 10px 30px rgba(0,0,0,0.3);
-        margin: 2rem 0;
-        text-align: center;
-    }
-    
-    .signup-header {
-        color: white;
-        font-size: 3rem;
-        margin-bottom: 0.5rem;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
-        font-weight: bold;
-    }
-    
-    .signup-subtitle {
-        color: rgba(255,255,255,0.9);
-        font-size: 1.3rem;
-        margin-bottom: 2rem;
-        font-weight: 300;
-    }
+class ChatHistoryStore:
+    """Persist each user's chat exchanges in SQLite so they survive reloads and restarts."""
     
-    .signup-form {
-        background: rgba(255,255,255,0.95);
-        padding: 2.5rem;
-        border-radius: 15px;
-        box-shadow: 0 5px 20px rgba(0,0,0,0.2);
-        margin: 2rem auto;
-        max-width: 400px;
-    }
+    def __init__(self, db_file: str = "chat_history.db"):
+        self.db_file = db_file
+        # Sessions run on different script threads, so share one connection behind a lock
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "username TEXT NOT NULL, "
+                "user_msg TEXT NOT NULL, "
+                "bot_msg TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (username, id)")
     
-    .form-title {
-        color: #667eea;
-        font-size: 2rem;
-        margin-bottom: 1.5rem;
-        font-weight: bold;
-        text-align: center;
-    }
+    def load_recent(self, username: str, limit: int) -> List[Tuple[str, str]]:
+        """Return a user's latest exchanges, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_msg, bot_msg FROM messages WHERE username = ? ORDER BY id DESC LIMIT ?",
+                (username, limit)
+            ).fetchall()
+        return rows[::-1]
     
-    .benefits-card {
-        background: linear-gradient(135deg, #ffecd2 0%, #fcb69f 100%);
-        padding: 1.5rem;
-        border-radius: 15px;
-        margin: 1rem 0;
-        box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-    }
+    def append(self, username: str, user_msg: str, bot_msg: str):
+        """Store one exchange."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO messages (username, user_msg, bot_msg) VALUES (?, ?, ?)",
+                (username, user_msg, bot_msg)
+            )
     
-    .feature-item {
-        display: flex;
-        align-items: center;
-        margin: 1rem 0;
-        padding: 0.5rem;
-        background: rgba(255,255,255,0.7);
-        border-radius: 10px;
-    }
+    def clear(self, username: str):
+        """Delete a user's stored exchanges."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE username = ?", (username,))
+
+@st.cache_resource
+def get_auth() -> AuthSystem:
+    """Load the user store once per server process instead of on every rerun.
     
-    .feature-icon {
-        font-size: 1.5rem;
-        margin-right: 1rem;
-        width: 40px;
-        text-align: center;
-    }
+    Every session shares this instance, so AuthSystem keeps its state behind locks.
+    """
+    return AuthSystem()
+
+@st.cache_resource
+def get_chat_store() -> ChatHistoryStore:
+    """Open the chat history database once per server process."""
+    return ChatHistoryStore()
+
+@st.cache_data(show_spinner=False)
+def _welcome_html(username: str, student_class: str, learning_goal: str) -> Tuple[str, str]:
+    """Build the main header and sidebar profile card for a user profile."""
+    username, student_class, learning_goal = (
+        html.escape(value) for value in (username, student_class, learning_goal)
+    )
     
-    .login-link {
-        text-align: center;
-        margin-top: 1.5rem;
-        padding: 1rem;
-        background: linear-gradient(135deg, #e3f2fd 0%, #bbdefb 100%);
-        border-radius: 10px;
-    }
+    # Create personalized welcome message
+    if student_class != "Not a student / Not applicable" and student_class != "Not specified":
+        welcome_subtitle = f"Your Personal Learning Assistant - Tailored for {student_class} Level"
+    else:
+        welcome_subtitle = "Your Personal Learning Assistant - Master Any Subject with AI-Powered Guidance"
     
-    .testimonial {
-        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        padding: 1.5rem;
-        border-radius: 15px;
-        color: white;
-        margin: 1rem 0;
-        text-align: center;
-        font-style: italic;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    header_html = _HEADER_TMPL.format(username=username, welcome_subtitle=welcome_subtitle)
+    profile_html = _PROFILE_TMPL.format(
+        username=username, student_class=student_class, learning_goal=learning_goal
+    )
+    return header_html, profile_html
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _kb_status(_vector_manager) -> dict:
+    """Knowledge base status, shared by the status panel and quiz start for a short while."""
+    # The leading underscore keeps Streamlit from trying to hash the vector manager
+    return _vector_manager.get_knowledge_base_status()
+
+def show_signup_page():
+    """Display the beautiful sign-up page."""
+    st.markdown(_page_css("signup"), unsafe_allow_html=True)
     
     # Main signup container
     st.markdown("""
@@ -304,18 +555,19 @@ def show_signup_page():
                 elif '@' not in email:
                     st.error("❌ Please enter a valid email address!")
                 else:
+                    now_iso = datetime.datetime.now().isoformat()
+                    
                     # Prepare user preferences
                     user_prefs = {
                         "learning_goal": learning_goal,
                         "student_class": student_class,
                         "subjects": subjects,
-                        "signup_date": datetime.datetime.now().isoformat()
+                        "signup_date": now_iso
                     }
                     
                     # Try to register user
-                    auth = AuthSystem()
-                    if auth.register_user(username, email, password, user_prefs):
-                        st.success("🎉 Account created successfully!")
+                    auth = get_auth()
+                    if auth.register_user(username, email, password, user_prefs, created_at=now_iso):
                         st.balloons()
                         
                         # Store in session state
@@ -324,8 +576,7 @@ def show_signup_page():
                         st.session_state.user_prefs = user_prefs
                         st.session_state.student_class = student_class
                         
-                        st.info("🔄 Redirecting to your dashboard...")
-                        time.sleep(2)
+                        st.toast("Account created successfully! Redirecting to your dashboard...", icon="🎉")
                         st.rerun()
                     else:
                         st.error("❌ Username already exists! Please choose a different one.")
@@ -338,7 +589,7 @@ def show_signup_page():
         </div>
         """, unsafe_allow_html=True)
         
-        # Educational level illustration
+        # Educational level and learning journey illustrations
         st.markdown("""
         <div style="background: linear-gradient(135deg, #a8edea 0%, #fed6e3 100%); padding: 1.5rem; border-radius: 15px; margin: 1rem 0; text-align: center;">
             <h4 style="color: #2c3e50; margin-bottom: 1rem;">🎒 Perfect for All Learning Levels</h4>
@@ -361,10 +612,6 @@ def show_signup_page():
                 </div>
             </div>
         </div>
-        """, unsafe_allow_html=True)
-        
-        # Learning journey illustration
-        st.markdown("""
         <div style="background: linear-gradient(135deg, #ffeaa7 0%, #fab1a0 100%); padding: 1.5rem; border-radius: 15px; margin: 1rem 0; text-align: center;">
             <h4 style="color: #2d3436; margin-bottom: 1rem;">🚀 Your Learning Journey</h4>
             <div style="display: flex; justify-content: space-between; align-items: center;">
@@ -391,25 +638,7 @@ def show_signup_page():
         </div>
         """, unsafe_allow_html=True)
         
-        features = [
-            ("🧠", "AI-Powered Learning", "Get personalized explanations and insights"),
-            ("📚", "Smart Document Processing", "Upload and analyze any study material"),
-            ("🎯", "Interactive Quizzes", "Test your knowledge with auto-generated questions"),
-            ("📊", "Progress Tracking", "Monitor your learning journey and achievements"),
-            ("💬", "24/7 AI Tutor", "Ask questions anytime, get instant answers"),
-            ("🏆", "Gamified Learning", "Earn streaks and celebrate milestones")
-        ]
-        
-        for icon, title, description in features:
-            st.markdown(f"""
-            <div class="feature-item">
-                <div class="feature-icon">{icon}</div>
-                <div>
-                    <strong style="color: #667eea;">{title}</strong><br>
-                    <small style="color: #666;">{description}</small>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+        st.markdown(_FEATURES_HTML, unsafe_allow_html=True)
         
         # Testimonial
         st.markdown("""
@@ -474,7 +703,7 @@ def show_login_page():
             submitted = st.form_submit_button("🚀 Sign In", use_container_width=True, type="primary")
             
             if submitted:
-                auth = AuthSystem()
+                auth = get_auth()
                 if auth.authenticate_user(username, password):
                     st.success("✅ Login successful!")
                     st.session_state.logged_in = True
@@ -507,11 +736,7 @@ def main():
     )
     
     # Initialize authentication
-    if 'logged_in' not in st.session_state:
-        st.session_state.logged_in = False
-    
-    if 'auth_page' not in st.session_state:
-        st.session_state.auth_page = "signup"
+    _init_session_state(_AUTH_DEFAULTS)
     
     # Authentication sidebar
     if not st.session_state.logged_in:
@@ -556,182 +781,50 @@ def main():
     
     # Rest of the main app (existing code)
     # Custom CSS for better styling
-    st.markdown("""
-    <style>
-    .main {
-        padding-top: 1rem;
-    }
-    
-    .stApp {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-    }
-    
-    .main-header {
-        background: linear-gradient(90deg, #4facfe 0%, #00f2fe 100%);
-        padding: 2rem;
-        border-radius: 15px;
-        text-align: center;
-        margin-bottom: 2rem;
-        box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-    }
-    
-    .main-header h1 {
-        color: #1e3a8a;
-        font-size: 3rem;
-        margin-bottom: 0.5rem;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-    }
-    
-    .main-header p {
-        color: #1e40af;
-        font-size: 1.2rem;
-        margin: 0;
-    }
-    
-    .chat-container {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-        margin-bottom: 1rem;
-    }
-    
-    .quiz-container {
-        background: linear-gradient(135deg, #ffecd2 0%, #fcb69f 100%);
-        padding: 1.5rem;
-        border-radius: 15px;
-        box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-    }
-    
-    .sidebar-section {
-        background: white;
-        padding: 1rem;
-        border-radius: 10px;
-        margin-bottom: 1rem;
-        box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-    }
-    
-    .metric-card {
-        background: linear-gradient(45deg, #667eea, #764ba2);
-        padding: 1rem;
-        border-radius: 10px;
-        text-align: center;
-        color: #1e40af;
-        margin: 0.5rem 0;
-    }
-    
-    .success-message {
-        background: linear-gradient(45deg, #56ab2f, #a8e6cf);
-        padding: 1rem;
-        border-radius: 10px;
-        color: #1e40af;
-        text-align: center;
-        margin: 1rem 0;
-    }
-    
-    .stButton > button {
-        background: linear-gradient(45deg, #667eea, #764ba2);
-        color: #1e40af;
-        border: none;
-        border-radius: 25px;
-        padding: 0.5rem 1rem;
-        font-weight: bold;
-        transition: all 0.3s ease;
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 15px rgba(0,0,0,0.2);
-    }
-    
-    .quiz-question {
-        background: rgba(255,255,255,0.9);
-        padding: 1.5rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-        border-left: 5px solid #667eea;
-    }
-    
-    .progress-bar {
-        background: linear-gradient(90deg, #4facfe 0%, #00f2fe 100%);
-        height: 10px;
-        border-radius: 5px;
-        margin: 1rem 0;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(_page_css("main"), unsafe_allow_html=True)
     
     # Initialize the interface
     if 'interface' not in st.session_state:
         st.session_state.interface = StreamlitRAGInterface()
     
-    # Initialize chat history
-    if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
-    
-    # Initialize quiz state
-    if 'quiz_active' not in st.session_state:
-        st.session_state.quiz_active = False
-    if 'current_question' not in st.session_state:
-        st.session_state.current_question = None
-    if 'quiz_score' not in st.session_state:
-        st.session_state.quiz_score = {'correct': 0, 'total': 0}
-    if 'study_streak' not in st.session_state:
-        st.session_state.study_streak = 0
-    if 'total_questions_answered' not in st.session_state:
-        st.session_state.total_questions_answered = 0
-    
     # Main header with attractive design and user welcome
     username = st.session_state.get('username', 'User')
-    student_class = st.session_state.get('student_class', 'Not specified')
     
-    # Create personalized welcome message
-    if student_class != "Not a student / Not applicable" and student_class != "Not specified":
-        welcome_subtitle = f"Your Personal Learning Assistant - Tailored for {student_class} Level"
-    else:
-        welcome_subtitle = "Your Personal Learning Assistant - Master Any Subject with AI-Powered Guidance"
+    # Restore only the exchanges that will be rendered, not the user's whole history
+    if 'chat_history' not in st.session_state:
+        st.session_state.chat_history = get_chat_store().load_recent(username, _CHAT_HISTORY_WINDOW)
     
-    st.markdown(f"""
-    <div class="main-header">
-        <h1>🎓 Welcome back, {username}!</h1>
-        <p>{welcome_subtitle}</p>
-    </div>
-    """, unsafe_allow_html=True)
+    # Initialize quiz state and progress counters
+    _init_session_state(_SESSION_DEFAULTS)
+    student_class = st.session_state.get('student_class', 'Not specified')
+    learning_goal = st.session_state.get('learning_goal', 'General Learning')
+    header_html, profile_html = _welcome_html(username, student_class, learning_goal)
+    
+    st.markdown(header_html, unsafe_allow_html=True)
     
     # Sidebar for controls
     with st.sidebar:
         # User profile section with class information
-        student_class = st.session_state.get('student_class', 'Not specified')
-        learning_goal = st.session_state.get('learning_goal', 'General Learning')
-        
-        st.markdown(f"""
-        <div class="sidebar-section">
-            <h3 style="text-align: center; color: #667eea; margin-bottom: 1rem;">👋 Hello, {username}!</h3>
-            <p style="text-align: center; color: #666; font-size: 0.9rem;">Ready to learn something new today?</p>
-            <div style="background: linear-gradient(135deg, #e3f2fd 0%, #bbdefb 100%); padding: 0.8rem; border-radius: 8px; margin-top: 1rem;">
-                <p style="margin: 0; font-size: 0.85rem; color: #1976d2;">
-                    <strong>🎓 Level:</strong> {student_class}<br>
-                    <strong>🎯 Goal:</strong> {learning_goal}
-                </p>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(profile_html, unsafe_allow_html=True)
         
         # Logout button
         if st.button("🚪 Logout", use_container_width=True):
             # Save user data before logout
-            auth = AuthSystem()
-            if username in auth.users:
-                auth.users[username]["study_streak"] = st.session_state.get("study_streak", 0)
-                auth.users[username]["total_questions"] = st.session_state.get("total_questions_answered", 0)
-                # Update user preferences if they exist
-                if hasattr(st.session_state, 'student_class'):
-                    auth.users[username]["student_class"] = st.session_state.get("student_class", "Not specified")
-                if hasattr(st.session_state, 'learning_goal'):
-                    auth.users[username]["learning_goal"] = st.session_state.get("learning_goal", "General Learning")
-                if hasattr(st.session_state, 'subjects'):
-                    auth.users[username]["subjects"] = st.session_state.get("subjects", [])
-                auth.save_users()
+            auth = get_auth()
+            fields = {
+                "study_streak": st.session_state.get("study_streak", 0),
+                "total_questions": st.session_state.get("total_questions_answered", 0),
+            }
+            # Update user preferences if they exist
+            if hasattr(st.session_state, 'student_class'):
+                fields["student_class"] = st.session_state.get("student_class", "Not specified")
+            if hasattr(st.session_state, 'learning_goal'):
+                fields["learning_goal"] = st.session_state.get("learning_goal", "General Learning")
+            if hasattr(st.session_state, 'subjects'):
+                fields["subjects"] = st.session_state.get("subjects", [])
+            if auth.update_user(username, fields):
+                # Written in the background so logout doesn't wait on the disk
+                auth.save_users_async()
             
             # Clear session state
             for key in list(st.session_state.keys()):
@@ -785,11 +878,9 @@ def main():
             if uploaded_files:
                 st.info(f"📄 {len(uploaded_files)} file(s) ready to upload")
                 if st.button("🚀 Process Files", use_container_width=True):
-                    with st.spinner("🔄 Processing your documents..."):
-                        success_count = process_uploaded_files(uploaded_files, assistant)
-                        if success_count > 0:
-                            st.balloons()  # Celebrate successful upload
-                            st.success(f"🎉 Successfully processed {success_count} file(s)!")
+                    saved_count = process_uploaded_files(uploaded_files, assistant)
+                    if saved_count > 0:
+                        st.info(f"📥 Saved {saved_count} file(s). Adding them to your knowledge base...")
         
         # Quick upload buttons with emojis
         st.markdown("**Quick Actions:**")
@@ -797,46 +888,37 @@ def main():
         
         with col1:
             if st.button("📄 Process PDFs", use_container_width=True):
-                with st.spinner("Processing PDF files..."):
-                    result = assistant.upload_service.upload_pdf_files(config.uploads_directory)
-                    if result['success']:
-                        st.success("✅ " + result['message'])
-                    else:
-                        st.error("❌ " + result['message'])
+                _start_ingest(assistant, "Processing PDF files...", ['.pdf'])
         
         with col2:
             if st.button("📝 Process TXTs", use_container_width=True):
-                with st.spinner("Processing TXT files..."):
-                    result = assistant.upload_service.upload_txt_files(config.uploads_directory)
-                    if result['success']:
-                        st.success("✅ " + result['message'])
-                    else:
-                        st.error("❌ " + result['message'])
+                _start_ingest(assistant, "Processing TXT files...", ['.txt'])
+        
+        # Uploads run in the background; poll while one is pending and report once it finishes
+        if "_ingest_job" in st.session_state:
+            _ingest_progress(assistant)
+        
+        result = st.session_state.pop("_ingest_result", None)
+        if result:
+            if result['success']:
+                if result.get('processed_files', 0) > 0:
+                    st.balloons()  # Celebrate successful upload
+                st.success("✅ " + result['message'])
+            else:
+                st.error("❌ " + result['message'])
         
         # Knowledge base status with visual elements
         with st.expander("📊 Knowledge Base Status", expanded=False):
             if st.button("🔄 Refresh Status", use_container_width=True):
-                status = assistant.vector_manager.get_knowledge_base_status()
+                status = _kb_status(assistant.vector_manager)
                 if status['success']:
                     # Create a simple visualization
                     if status['total_chunks'] > 0:
                         st.metric("📚 Total Knowledge Chunks", status['total_chunks'])
                         
-                        if status['file_types']:
-                            # Create a pie chart for file types
-                            file_types = status['file_types']
-                            if len(file_types) > 1:
-                                fig = px.pie(
-                                    values=list(file_types.values()),
-                                    names=[f"{k.upper()} Files" for k in file_types.keys()],
-                                    title="Document Types in Knowledge Base"
-                                )
-                                fig.update_layout(height=300)
-                                st.plotly_chart(fig, use_container_width=True)
-                            else:
-                                for file_type, count in file_types.items():
-                                    emoji = "📄" if file_type == 'pdf' else "📝"
-                                    st.write(f"{emoji} {file_type.upper()}: {count} chunks")
+                        for file_type, count in status['file_types'].items():
+                            emoji = "📄" if file_type == 'pdf' else "📝"
+                            st.write(f"{emoji} {file_type.upper()}: {count} chunks")
                     else:
                         st.info("🗂️ Knowledge base is empty. Upload some documents to get started!")
                 else:
@@ -886,20 +968,8 @@ def main():
                 </div>
                 """, unsafe_allow_html=True)
             
-            for i, (user_msg, bot_msg) in enumerate(st.session_state.chat_history):
-                # User message with custom styling
-                st.markdown(f"""
-                <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 1rem; border-radius: 15px; margin: 0.5rem 0; color: white;">
-                    <strong>🧑‍🎓 You:</strong> {user_msg}
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Bot response with custom styling
-                st.markdown(f"""
-                <div style="background: linear-gradient(135deg, #ffecd2 0%, #fcb69f 100%); padding: 1rem; border-radius: 15px; margin: 0.5rem 0;">
-                    <strong style="color: #2c3e50;">🤖 AI Tutor:</strong> <span style="color: #2c3e50;">{bot_msg}</span>
-                </div>
-                """, unsafe_allow_html=True)
+            if st.session_state.chat_history:
+                _render_chat_history(st.session_state.chat_history)
         
         # Enhanced chat input
         st.markdown("---")
@@ -918,10 +988,22 @@ def main():
                         else:
                             context_prompt = f"[Learning Goal: {learning_goal}] {prompt}"
                         
-                        response = assistant.process_user_input(context_prompt)
+                        # Stream tokens into a placeholder so the answer appears as it is generated
+                        with chat_container:
+                            with st.chat_message("user", avatar=_USER_AVATAR):
+                                st.markdown(prompt)
+                            placeholder = st.chat_message("assistant", avatar=_BOT_AVATAR).empty()
+                            response = ""
+                            for token in assistant.process_user_input_stream(
+                                context_prompt, history=st.session_state.session_turns
+                            ):
+                                response += token
+                                placeholder.markdown(response)
                         
                         # Add to chat history (show original prompt to user)
                         st.session_state.chat_history.append((prompt, response))
+                        st.session_state.session_turns.append((prompt, response))
+                        get_chat_store().append(username, prompt, response)
                         st.session_state.total_questions_answered += 1
                         
                         # Update study streak
@@ -958,10 +1040,11 @@ def main():
             
             if st.button("🎲 Start Quiz Challenge", use_container_width=True, type="primary"):
                 # Check if knowledge base has content
-                status = assistant.vector_manager.get_knowledge_base_status()
+                status = _kb_status(assistant.vector_manager)
                 if status.get('total_chunks', 0) > 0:
                     st.session_state.quiz_active = True
                     st.session_state.quiz_score = {'correct': 0, 'total': 0}
+                    st.session_state.quiz_queue = None  # Reshuffle for every new quiz
                     # Generate first question
                     generate_quiz_question(assistant)
                     st.rerun()
@@ -971,41 +1054,19 @@ def main():
             # Display some motivational stats
             if st.session_state.total_questions_answered > 0:
                 st.markdown("### 📈 Your Learning Journey")
-                fig = go.Figure(go.Indicator(
-                    mode = "gauge+number",
-                    value = min(100, (st.session_state.total_questions_answered / 50) * 100),
-                    domain = {'x': [0, 1], 'y': [0, 1]},
-                    title = {'text': "Learning Progress"},
-                    gauge = {
-                        'axis': {'range': [None, 100]},
-                        'bar': {'color': "darkblue"},
-                        'steps': [
-                            {'range': [0, 25], 'color': "lightgray"},
-                            {'range': [25, 50], 'color': "gray"},
-                            {'range': [50, 75], 'color': "lightblue"},
-                            {'range': [75, 100], 'color': "blue"}
-                        ],
-                        'threshold': {
-                            'line': {'color': "red", 'width': 4},
-                            'thickness': 0.75,
-                            'value': 90
-                        }
-                    }
-                ))
-                fig.update_layout(height=200)
-                st.plotly_chart(fig, use_container_width=True)
+                progress = min(100, (st.session_state.total_questions_answered / 50) * 100)
+                st.metric("Learning Progress", f"{progress:.0f}%")
+                st.progress(progress / 100)
                 
         else:
             # Active quiz section with better styling
             if st.session_state.current_question:
                 question_data = st.session_state.current_question
                 
-                st.markdown(f"""
-                <div class="quiz-question">
-                    <h4 style="color: #000000;">📝 Question {st.session_state.quiz_score['total'] + 1}</h4>
-                    <p><strong style="color: #000000;">{question_data["question"]}</strong></p>
-                </div>
-                """, unsafe_allow_html=True)
+                st.markdown(_QUIZ_QUESTION_TMPL.format(
+                    number=st.session_state.quiz_score['total'] + 1,
+                    question=html.escape(question_data["question"])
+                ), unsafe_allow_html=True)
                 
                 # Answer options with better styling
                 answer = st.radio(
@@ -1025,16 +1086,16 @@ def main():
                         
                         st.session_state.quiz_score['total'] += 1
                         
+                        # Toasts outlive the rerun below, so feedback shows without pausing the server thread
                         if selected_letter == correct_letter:
                             st.session_state.quiz_score['correct'] += 1
-                            st.success("🎉 Excellent! Correct answer!")
+                            st.toast("Excellent! Correct answer!", icon="🎉")
                             st.balloons()
                         else:
-                            st.error(f"🤔 Not quite right. The correct answer was {correct_letter}.")
-                            st.info("💡 Keep learning! Every mistake is a step towards mastery.")
+                            st.toast(f"Not quite right. The correct answer was {correct_letter}. "
+                                     "Keep learning! Every mistake is a step towards mastery.", icon="🤔")
                         
                         # Generate next question
-                        time.sleep(1)  # Brief pause for feedback
                         generate_quiz_question(assistant)
                         st.rerun()
                 
@@ -1068,16 +1129,16 @@ def main():
         
         if st.button("🧹 Clear Chat History", use_container_width=True):
             st.session_state.chat_history = []
-            st.success("✨ Chat cleared! Ready for a fresh start!")
-            time.sleep(1)
+            st.session_state.session_turns = []
+            get_chat_store().clear(username)
+            st.toast("Chat cleared! Ready for a fresh start!", icon="✨")
             st.rerun()
         
         if st.button("🔄 Reset Progress", use_container_width=True):
             st.session_state.study_streak = 0
             st.session_state.total_questions_answered = 0
             st.session_state.quiz_score = {'correct': 0, 'total': 0}
-            st.info("📊 Progress reset! Time for a new learning journey!")
-            time.sleep(1)
+            st.toast("Progress reset! Time for a new learning journey!", icon="📊")
             st.rerun()
     
     # Footer with credits and tips
@@ -1088,47 +1149,99 @@ def main():
     </div>
     """, unsafe_allow_html=True)
 
+def _save_upload(uploaded_file, uploads_path: Path) -> Path:
+    """Write an uploaded file straight into the uploads directory."""
+    final_path = uploads_path / uploaded_file.name
+    # getbuffer() is a view over the upload already held in memory; getvalue() would copy it
+    final_path.write_bytes(uploaded_file.getbuffer())
+    return final_path
+
 def process_uploaded_files(uploaded_files, assistant):
     """Process uploaded files with better error handling and user feedback."""
-    success_count = 0
+    # Skip files this session already ingested (re-clicks, unchanged uploader contents)
+    ingested_hashes = st.session_state.setdefault("_ingested_hashes", set())
+    file_hashes = {}
     for uploaded_file in uploaded_files:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_path = tmp_file.name
-        
-        try:
-            # Move to uploads directory
-            uploads_path = Path(config.uploads_directory)
-            uploads_path.mkdir(exist_ok=True)
-            final_path = uploads_path / uploaded_file.name
-            
-            # Copy file to uploads directory
-            import shutil
-            shutil.move(tmp_path, final_path)
-            success_count += 1
-            
-        except Exception as e:
-            st.error(f"Error saving {uploaded_file.name}: {str(e)}")
+        digest = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+        if digest not in ingested_hashes and digest not in file_hashes.values():
+            file_hashes[uploaded_file.name] = digest
+    
+    new_files = [f for f in uploaded_files if f.name in file_hashes]
+    if not new_files:
+        st.info("✅ These files are already in your knowledge base.")
+        return 0
+    
+    uploads_path = Path(config.uploads_directory)
+    uploads_path.mkdir(exist_ok=True)
+    
+    # The writes are independent, so save them in parallel; errors are reported here
+    # because Streamlit calls only work from the script thread
+    success_count = 0
+    saved_hashes = []
+    with ThreadPoolExecutor(max_workers=min(8, len(new_files))) as executor:
+        futures = [(f, executor.submit(_save_upload, f, uploads_path)) for f in new_files]
+        for uploaded_file, future in futures:
             try:
-                os.unlink(tmp_path)
-            except:
-                pass
+                future.result()
+                success_count += 1
+                saved_hashes.append(file_hashes[uploaded_file.name])
+            except Exception as e:
+                st.error(f"Error saving {uploaded_file.name}: {str(e)}")
     
     if success_count > 0:
-        # Process the uploaded files
-        result = assistant.upload_service.upload_documents(config.uploads_directory)
-        if result['success']:
-            return success_count
-        else:
-            st.error(f"❌ {result['message']}")
+        # Process the uploaded files; hashes are recorded once the upload succeeds
+        if not _start_ingest(assistant, "🔄 Processing your documents...", file_hashes=saved_hashes):
             return 0
-    return 0
+    return success_count
+
+def _start_ingest(assistant, label: str, file_types: List[str] = None, file_hashes: List[str] = ()) -> bool:
+    """Queue a background upload for this session unless one is already running."""
+    if "_ingest_job" in st.session_state:
+        st.info("⏳ Your previous upload is still being processed.")
+        return False
+    st.session_state._ingest_job = {
+        "future": assistant.start_upload(file_types),
+        "label": label,
+        "hashes": list(file_hashes),
+    }
+    return True
+
+@st.fragment(run_every=1.0)
+def _ingest_progress(assistant):
+    """Show progress of the session's background upload and hand off its result when done."""
+    job = st.session_state.get("_ingest_job")
+    if job is None:
+        return
+    
+    future = job["future"]
+    if not future.done():
+        # Progress lives on the shared upload service, so it tracks whichever upload is running
+        done, total = assistant.upload_service.progress
+        st.progress(done / total if total else 0.0, text=job["label"])
+        return
+    
+    del st.session_state["_ingest_job"]
+    try:
+        result = future.result()
+    except Exception as e:
+        result = {'success': False, 'message': str(e)}
+    
+    if result['success']:
+        st.session_state.setdefault("_ingested_hashes", set()).update(job["hashes"])
+        _kb_status.clear()
+    st.session_state._ingest_result = result
+    st.rerun()
 
 def generate_quiz_question(assistant):
     """Generate a new quiz question with better error handling."""
     try:
-        contexts = assistant.vector_manager.get_random_knowledge_chunks(num_chunks=1)
+        # Draw from a shuffled queue so a quiz doesn't repeat a chunk until it has used them all
+        chunk_queue = st.session_state.get("quiz_queue")
+        if not chunk_queue:
+            chunk_queue = st.session_state.quiz_queue = deque(
+                assistant.vector_manager.shuffle_knowledge_chunks(_QUIZ_QUEUE_SIZE)
+            )
+        contexts = [chunk_queue.popleft()] if chunk_queue else []
         if contexts:
             # Get user context for appropriate difficulty level
             student_class = st.session_state.get('student_class', 'Not specified')
@@ -1168,8 +1281,9 @@ def end_quiz():
         else:
             message = "📚 Don't worry! Every expert was once a beginner. Keep learning!"
         
-        st.success(f"🏁 Quiz completed! Final score: {score['correct']}/{score['total']} ({percentage:.1f}%)")
-        st.info(message)
+        # Callers rerun straight away, so use toasts that survive it
+        st.toast(f"Quiz completed! Final score: {score['correct']}/{score['total']} ({percentage:.1f}%)", icon="🏁")
+        st.toast(message)
     
     st.session_state.quiz_active = False
     st.session_state.current_question = None
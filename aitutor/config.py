@@ -12,7 +12,7 @@ class Config:
         if not self.mistral_api_key:
             raise ValueError("Missing MISTRAL_API_KEY in .env")
         
-        # Directory settings
+        # Directory settings (point both Chroma dirs at one path to share a client)
         self.uploads_directory = "./uploads"
         self.chroma_memory_dir = "./chroma_storage"
         self.chroma_kb_dir = "./kb_storage"
@@ -23,11 +23,53 @@ class Config:
         
         # Chunking settings
         self.chunk_size = 500
-        self.chunk_overlap = 50
+        # Structural splits keep chunks self-contained, so overlap only adds duplicate tokens
+        self.chunk_overlap = 0
+        
+        # Embedding settings
+        self.embedding_batch_size = 64
+        self.embedding_cache_size = 1024
+        self.embedding_workers = 4
         
         # Retrieval settings
         self.memory_k = 5
         self.knowledge_k = 3
+        self.knowledge_fetch_k = 20
+        self.mmr_lambda = 0.5
+        # HNSW ef_search per collection (Chroma's default is 100), written to the persisted
+        # collection configuration; knowledge is raised to at least knowledge_fetch_k
+        self.memory_search_ef = 32
+        self.knowledge_search_ef = 64
+        self.recent_turns_window = 10
+        
+        # Prompt context budgets (approximate tokens)
+        self.memory_token_budget = 500
+        self.knowledge_token_budget = 1500
+        
+        # Drop weakly related context before it reaches the prompt (set to 0 to keep everything).
+        # Knowledge uses cosine similarity. Unrelated chunk pairs from this embedding model already
+        # score ~0.65 (1st percentile) to ~0.77 (median), so the floor sits just above that median.
+        # Memory uses the same relevance score as the semantic cache, 1 - d/sqrt(2) over Chroma's
+        # squared L2 distance (d = 2 - 2*cos for unit vectors); 0.69 is that same cos ~0.78 floor.
+        self.memory_min_relevance = 0.69
+        self.knowledge_min_relevance = 0.78
+        # Cached knowledge retrievals, dropped whenever the knowledge base changes (set to 0 to disable)
+        self.knowledge_cache_size = 256
+        
+        # Semantic cache settings (set to 0 to disable)
+        self.semantic_cache_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        
+        # Clear memory and the knowledge base on startup (also available as the 'reset' command)
+        self.reset_on_start = os.getenv("RAG_RESET_ON_START") == "1"
+        
+        # Render workflow_graph.png on startup if it is missing (also available as the 'graph' command)
+        self.draw_workflow_graph = os.getenv("DRAW_WORKFLOW_GRAPH") == "1"
+        
+        # Exact-match response and quiz question cache entries (set to 0 to disable)
+        self.response_cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+        
+        # Open the Mistral API connections in the background at startup
+        self.prewarm_connections = os.getenv("PREWARM_CONNECTIONS", "1") == "1"
 
 # Global config instance
 config = Config()
\ No newline at end of file
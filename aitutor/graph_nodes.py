@@ -1,11 +1,16 @@
-from typing import TypedDict, Optional
+from typing import TypedDict, Optional, List, Tuple, Union
 from langchain_mistralai.chat_models import ChatMistralAI
 from langchain.schema import HumanMessage
+from langgraph.graph import END
 from vector_store_manager import VectorStoreManager
 
 # State schema
 class AgentState(TypedDict):
     input: str
+    history: Optional[List[Tuple[str, str]]]
+    query_embedding: Optional[List[float]]
+    kb_version: Optional[str]
+    cache_hit: Optional[bool]
     memory: Optional[str]
     knowledge: Optional[str]
     response: Optional[str]
@@ -13,31 +18,64 @@ class AgentState(TypedDict):
 class GraphNodes:
     """Contains all the node functions for the LangGraph workflow."""
     
-    def __init__(self, llm: ChatMistralAI, vector_manager: VectorStoreManager):
+    def __init__(self, llm: ChatMistralAI, vector_manager: VectorStoreManager, cache_threshold: float = 0.95,
+                 memory_token_budget: Optional[int] = None, knowledge_token_budget: Optional[int] = None):
         self.llm = llm
         self.vector_manager = vector_manager
+        self.cache_threshold = cache_threshold
+        self.memory_token_budget = memory_token_budget
+        self.knowledge_token_budget = knowledge_token_budget
     
+    def check_cache_node(self, state: AgentState) -> AgentState:
+        """Node to embed the query once and short-circuit on a semantic cache hit."""
+        query_embedding = self.vector_manager.embed_query(state["input"])
+        kb_version = self.vector_manager.kb_version
+
+        cached = None
+        # Follow-ups depend on the recent turns, so only questions asked without history can reuse an answer
+        if 0 < self.cache_threshold <= 1 and not state.get("history"):
+            cached = self.vector_manager.lookup_cached_response(query_embedding, self.cache_threshold, kb_version)
+
+        state = {**state, "query_embedding": query_embedding, "kb_version": kb_version}
+        if cached is not None:
+            return {**state, "cache_hit": True, "response": cached}
+        return {**state, "cache_hit": False}
+    
+    def route_after_cache(self, state: AgentState) -> Union[str, List[str]]:
+        """Route to END on a cache hit, otherwise fan out to both retrieval nodes."""
+        if state.get("cache_hit"):
+            return END
+        return ["retrieve_memory", "retrieve_knowledge"]
+    
+    # The retrieval nodes run in the same step, so they only return the key they own
     def retrieve_memory_node(self, state: AgentState) -> AgentState:
         """Node to retrieve relevant memory."""
-        query = state["input"]
-        memory = self.vector_manager.load_memory_variables(query)
-        return {**state, "memory": memory}
+        memory = self.vector_manager.load_memory_by_vector(
+            state["query_embedding"], token_budget=self.memory_token_budget
+        )
+        return {"memory": memory}
     
     def retrieve_knowledge_node(self, state: AgentState) -> AgentState:
         """Node to retrieve relevant knowledge."""
-        query = state["input"]
-        knowledge = self.vector_manager.retrieve_knowledge(query)
-        return {**state, "knowledge": knowledge}
+        knowledge = self.vector_manager.retrieve_knowledge_by_vector(
+            state["query_embedding"], token_budget=self.knowledge_token_budget
+        )
+        return {"knowledge": knowledge}
     
     def generate_response_node(self, state: AgentState) -> AgentState:
         """Node to generate LLM response."""
         memory = state.get("memory", "")
         knowledge = state.get("knowledge", "")
         query = state["input"]
+        # Short-term window of the latest turns; Chroma memory adds older, semantically related ones
+        recent = "\n".join(
+            f"User: {user_msg}\nAssistant: {bot_msg}" for user_msg, bot_msg in state.get("history") or []
+        )
 
         prompt = "\n\n".join(filter(None, [
             f"Knowledge:\n{knowledge}" if knowledge else "",
             f"Conversation History:\n{memory}" if memory else "",
+            f"Recent Conversation:\n{recent}" if recent else "",
             f"User: {query}"
         ]))
 
@@ -46,8 +84,12 @@ class GraphNodes:
     
     def update_memory_node(self, state: AgentState) -> AgentState:
         """Node to update memory with conversation."""
-        self.vector_manager.save_memory_context(
+        # Persist in the background so the response is returned without waiting on the write
+        # Answers that leaned on recent turns are kept as memory but never served from the cache
+        self.vector_manager.save_memory_context_async(
             state["input"], 
-            state["response"]
+            state["response"],
+            query_embedding=state.get("query_embedding"),
+            kb_version=None if state.get("history") else state.get("kb_version")
         )
         return {}
\ No newline at end of file
@@ -1,4 +1,11 @@
 import json
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Iterator, List, Optional, Tuple
 from langchain_mistralai.chat_models import ChatMistralAI
 from langgraph.graph import StateGraph, END
 from langchain_core.runnables.graph_mermaid import draw_mermaid_png
@@ -12,6 +19,40 @@ from vector_store_manager import VectorStoreManager
 from graph_nodes import AgentState, GraphNodes
 from upload_service import UploadService
 
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+class _LRUCache:
+    """Small thread-safe LRU map keyed by a content hash of the input text."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.strip().lower().encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: str, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
 class RAGAssistant:
     """Main RAG Assistant application."""
 
@@ -20,7 +61,19 @@ class RAGAssistant:
         self.vector_manager = VectorStoreManager(
             api_key=config.mistral_api_key,
             memory_dir=config.chroma_memory_dir,
-            kb_dir=config.chroma_kb_dir
+            kb_dir=config.chroma_kb_dir,
+            memory_k=config.memory_k,
+            knowledge_k=config.knowledge_k,
+            knowledge_fetch_k=config.knowledge_fetch_k,
+            mmr_lambda=config.mmr_lambda,
+            memory_search_ef=config.memory_search_ef,
+            knowledge_search_ef=config.knowledge_search_ef,
+            embedding_batch_size=config.embedding_batch_size,
+            embedding_workers=config.embedding_workers,
+            embedding_cache_size=config.embedding_cache_size,
+            memory_min_relevance=config.memory_min_relevance,
+            knowledge_min_relevance=config.knowledge_min_relevance,
+            knowledge_cache_size=config.knowledge_cache_size
         )
 
         self.llm = ChatMistralAI(
@@ -35,51 +88,161 @@ class RAGAssistant:
         )
 
         self.upload_service = UploadService(self.processor, self.vector_manager)
-        self.graph_nodes = GraphNodes(self.llm, self.vector_manager)
+        # One worker so background uploads run in order and never race on the same files
+        self._ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self.graph_nodes = GraphNodes(
+            self.llm,
+            self.vector_manager,
+            cache_threshold=config.semantic_cache_threshold,
+            memory_token_budget=config.memory_token_budget,
+            knowledge_token_budget=config.knowledge_token_budget
+        )
+
+        # Exact repeats skip the graph entirely, before even the embedding call
+        self._response_cache = _LRUCache(config.response_cache_size)
+        self._quiz_cache = _LRUCache(config.response_cache_size)
+
+        # Recent (input, response) turns for the command-line chat; the web app keeps its own per session
+        self.recent_turns = deque(maxlen=config.recent_turns_window)
 
         # Initialize the graph
         self.memory_agent = self._create_graph()
 
-        # Reset collections on startup
-        # self.vector_manager.reset_collections()
+        # Wiping the stores forces every file to be re-embedded, so it is opt-in
+        if config.reset_on_start:
+            self.reset()
+
+        # Open the API connections now so the first question doesn't pay the TLS handshake
+        if config.prewarm_connections:
+            threading.Thread(target=self._prewarm_connections, name="prewarm", daemon=True).start()
+
+    def _prewarm_connections(self):
+        """Establish keep-alive connections for the chat and embedding clients."""
+        # Listing models is free and goes through the same pooled httpx clients as real calls
+        for client in (self.llm.client, self.vector_manager.embedding.client):
+            try:
+                client.get("/models")
+            except Exception as e:
+                print(f"⚠️ Could not pre-warm Mistral connection: {str(e)}")
 
     def _create_graph(self):
         """Create and compile the LangGraph workflow."""
         graph = StateGraph(AgentState)
 
         # Add nodes
+        graph.add_node("check_cache", self.graph_nodes.check_cache_node)
         graph.add_node("retrieve_memory", self.graph_nodes.retrieve_memory_node)
         graph.add_node("retrieve_knowledge", self.graph_nodes.retrieve_knowledge_node)
         graph.add_node("generate_response", self.graph_nodes.generate_response_node)
         graph.add_node("update_memory", self.graph_nodes.update_memory_node)
 
         # Set entry point and edges
-        graph.set_entry_point("retrieve_memory")
-        graph.add_edge("retrieve_memory", "retrieve_knowledge")
-        graph.add_edge("retrieve_knowledge", "generate_response")
+        graph.set_entry_point("check_cache")
+        # Memory and knowledge retrieval are independent, so they run in parallel
+        graph.add_conditional_edges(
+            "check_cache",
+            self.graph_nodes.route_after_cache,
+            ["retrieve_memory", "retrieve_knowledge", END]
+        )
+        graph.add_edge(["retrieve_memory", "retrieve_knowledge"], "generate_response")
         graph.add_edge("generate_response", "update_memory")
         graph.add_edge("update_memory", END)
 
-        # Generate graph visualization
         app = graph.compile()
+
+        # Drawing goes through a remote renderer, so it is opt-in rather than part of startup
+        if config.draw_workflow_graph and not os.path.exists("workflow_graph.png"):
+            self.export_graph(app)
+
+        return app
+
+    def reset(self):
+        """Clear memory, the knowledge base and every cache derived from them."""
+        self.vector_manager.reset_collections()
+        self.upload_service.forget_ingested()
+        self._response_cache.clear()
+        self._quiz_cache.clear()
+        self.recent_turns.clear()
+
+    def export_graph(self, app=None, output_file_path: str = "workflow_graph.png") -> bool:
+        """Render the workflow graph to a PNG file."""
+        app = app or self.memory_agent
         try:
             mermaid_str = app.get_graph().draw_mermaid()
             draw_mermaid_png(
                 mermaid_syntax=mermaid_str,
-                output_file_path="workflow_graph.png",
+                output_file_path=output_file_path,
                 background_color="white",
                 padding=20,
             )
-            print("📊 Workflow graph saved as workflow_graph.png")
+            print(f"📊 Workflow graph saved as {output_file_path}")
+            return True
         except Exception as e:
             print(f"⚠️ Could not generate workflow graph: {str(e)}")
+            return False
 
-        return app
+    def _graph_input(self, user_input: str, history: Optional[List[Tuple[str, str]]]) -> dict:
+        """Build the graph input, keeping only the most recent turns of history."""
+        window = config.recent_turns_window
+        return {"input": user_input, "history": list(history)[-window:] if history and window > 0 else []}
+
+    def _response_cache_key(self, graph_input: dict) -> str:
+        """Key an answer on everything the prompt depends on besides retrieval."""
+        # kb_version makes uploads and resets invalidate answers given against older contents
+        return self._response_cache.key(json.dumps(
+            [graph_input["input"], graph_input["history"], self.vector_manager.kb_version]
+        ))
 
-    def process_user_input(self, user_input: str) -> str:
+    def process_user_input(self, user_input: str, history: Optional[List[Tuple[str, str]]] = None) -> str:
         """Process user input and return response."""
-        result = self.memory_agent.invoke({"input": user_input})
-        return result.get("response", "Sorry, I couldn't generate a response.")
+        graph_input = self._graph_input(user_input, history)
+        cache_key = self._response_cache_key(graph_input)
+        cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        result = self.memory_agent.invoke(graph_input)
+        response = result.get("response")
+        if not response:
+            return "Sorry, I couldn't generate a response."
+        self._response_cache.put(cache_key, response)
+        return response
+
+    def process_user_input_stream(self, user_input: str,
+                                  history: Optional[List[Tuple[str, str]]] = None) -> Iterator[str]:
+        """Process user input and yield the response as it is generated."""
+        graph_input = self._graph_input(user_input, history)
+        cache_key = self._response_cache_key(graph_input)
+        cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        streamed = []
+        final_state = {}
+        for mode, payload in self.memory_agent.stream(graph_input, stream_mode=["messages", "values"]):
+            if mode == "messages":
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") == "generate_response" and chunk.content:
+                    streamed.append(chunk.content)
+                    yield chunk.content
+            else:
+                final_state = payload
+
+        # Cache hits skip the LLM, so the full answer only arrives with the final state
+        response = "".join(streamed) or final_state.get("response")
+        if not response:
+            yield "Sorry, I couldn't generate a response."
+            return
+        if not streamed:
+            yield response
+        self._response_cache.put(cache_key, response)
+
+    def start_upload(self, file_types: Optional[List[str]] = None) -> Future:
+        """Upload documents from the uploads directory on a background thread."""
+        return self._ingest_executor.submit(
+            self.upload_service.upload_documents, config.uploads_directory, file_types
+        )
 
     def handle_command(self, command: str) -> bool:
         """Handle special commands. Returns True if command was handled."""
@@ -128,6 +291,19 @@ class RAGAssistant:
                 print(file_info['message'])
             return True
 
+        elif command == "reset":
+            # Wiping both stores can't be undone, so a bare word typed as a chat message must not trigger it
+            confirm = input("⚠️ This deletes all memory and the whole knowledge base. Type 'yes' to confirm: ")
+            if confirm.strip().lower() == "yes":
+                self.reset()
+            else:
+                print("Reset cancelled.")
+            return True
+
+        elif command == "graph":
+            self.export_graph()
+            return True
+
         elif command == "quiz":
             self._start_quiz()
             return True
@@ -146,12 +322,19 @@ class RAGAssistant:
         print("   'upload-txt' - Process only .txt files")
         print("   'status'     - Show knowledge base status")
         print("   'files'      - List files in uploads directory")
+        print("   'reset'      - Clear memory and the knowledge base (asks for confirmation)")
+        print("   'graph'      - Save the workflow graph as workflow_graph.png")
         print("   'quiz'       - Start a quiz based on the knowledge base")
         print("   'help'       - Show this help message")
         print("   'exit' or 'quit' - Exit the application")
 
     def _generate_quiz_question(self, context: str) -> dict:
         """Generate a quiz question from a context snippet."""
+        cache_key = self._quiz_cache.key(context)
+        cached = self._quiz_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         prompt = f"""
         Based on the following context, please generate a single multiple-choice question.
         The question should test understanding of the key information in the text.
@@ -175,9 +358,13 @@ class RAGAssistant:
         """
         try:
             response = self.llm.invoke([HumanMessage(content=prompt)])
-            # Clean up the response content to ensure it's a valid JSON string
-            json_string = response.content.strip().replace("```json", "").replace("```", "")
-            return json.loads(json_string)
+            # Take the outermost {...} span so code fences or surrounding prose don't break parsing
+            match = _JSON_OBJECT_RE.search(response.content)
+            if match is None:
+                raise json.JSONDecodeError("No JSON object found", response.content, 0)
+            quiz_data = json.loads(match.group(0))
+            self._quiz_cache.put(cache_key, quiz_data)
+            return quiz_data
         except (json.JSONDecodeError, AttributeError) as e:
             print(f"⚠️ Could not parse quiz question from LLM response: {e}")
             return None
@@ -243,9 +430,11 @@ class RAGAssistant:
                 continue
 
             # Process regular chat input
-            response = self.process_user_input(user_input)
+            response = self.process_user_input(user_input, history=self.recent_turns)
+            self.recent_turns.append((user_input, response))
             print("Agent:", response)
 
+        self.vector_manager.flush_pending_writes()
         print(f"\n✅ Memory and knowledge saved in {config.chroma_memory_dir} and {config.chroma_kb_dir}")
 
 def main():
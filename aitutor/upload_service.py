@@ -1,5 +1,7 @@
-from typing import List
+from typing import List, Dict, Tuple
+import os
 from pathlib import Path
+import hashlib
 from document_processor import DocumentProcessor
 from vector_store_manager import VectorStoreManager
 
@@ -9,6 +11,20 @@ class UploadService:
     def __init__(self, processor: DocumentProcessor, vector_manager: VectorStoreManager):
         self.processor = processor
         self.vector_manager = vector_manager
+        # Content digest of every file already ingested, keyed by path
+        self._ingested_digests: Dict[str, str] = {}
+        # (files done, files total) of the running upload, for progress display from other threads
+        self.progress: Tuple[int, int] = (0, 0)
+    
+    def forget_ingested(self):
+        """Forget which files were ingested, e.g. after the knowledge base is reset."""
+        self._ingested_digests.clear()
+    
+    @staticmethod
+    def _file_digest(file_path: Path) -> str:
+        """Hash a file's bytes without loading it into memory at once."""
+        with open(file_path, 'rb') as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
     
     def upload_documents(self, directory: str = "./uploads", file_types: List[str] = None) -> dict:
         """Process and upload documents of specified types."""
@@ -25,26 +41,49 @@ class UploadService:
                 'total_chunks': 0
             }
         
-        all_documents = []
-        processed_files = 0
+        # Only re-extract and re-split files whose bytes changed since the last upload
+        digests = {str(f): self._file_digest(f) for f in files}
+        pending = [f for f in files if self._ingested_digests.get(str(f)) != digests[str(f)]]
+        
+        if not pending:
+            return {
+                'success': True,
+                'message': f"✅ All {len(files)} file(s) are already in the knowledge base.",
+                'processed_files': 0,
+                'total_chunks': 0
+            }
+        
         file_type_counts = {'.pdf': 0, '.txt': 0}
         
-        for file_path in files:
+        # The last step counts the embedding and store of all chunks
+        total_steps = len(pending) + 1
+        self.progress = (0, total_steps)
+        
+        for file_path in pending:
             file_ext = file_path.suffix.lower()
             print(f"{'📄' if file_ext == '.pdf' else '📝'} Processing {file_ext.upper()}: {file_path.name}")
-            
-            documents, success = self.processor.process_file(file_path)
-            
-            if success:
-                all_documents.extend(documents)
-                processed_files += 1
-                file_type_counts[file_ext] += 1
-            else:
-                print(f"⚠️ No text extracted from {file_path.name}")
+        
+        def report_progress(done: int):
+            self.progress = (done, total_steps)
+        
+        # One splitter call over every extracted file instead of one per file
+        all_documents, extracted = self.processor.process_files(pending, on_progress=report_progress)
+        
+        processed_paths = [str(f) for f in extracted]
+        processed_files = len(processed_paths)
+        for file_path in extracted:
+            file_type_counts[file_path.suffix.lower()] += 1
+        extracted_set = set(extracted)
+        for file_path in [f for f in pending if f not in extracted_set]:
+            print(f"⚠️ No text extracted from {file_path.name}")
         
         if all_documents:
             success = self.vector_manager.add_documents_to_knowledge_base(all_documents)
+            self.progress = (total_steps, total_steps)
             if success:
+                for path in processed_paths:
+                    self._ingested_digests[path] = digests[path]
+                
                 message = f"✅ Added {len(all_documents)} chunks from {processed_files} file(s) to the knowledge base."
                 for ext, count in file_type_counts.items():
                     if count > 0:
@@ -85,12 +124,23 @@ class UploadService:
                 'txt_files': []
             }
         
-        pdf_files = list(uploads_dir.glob("*.pdf"))
-        txt_files = list(uploads_dir.glob("*.txt"))
+        # One directory scan classifies every entry instead of one glob per type
+        pdf_files = []
+        txt_files = []
+        with os.scandir(uploads_dir) as entries:
+            for entry in entries:
+                # Same rule as DocumentProcessor.get_files_by_type, so this lists exactly what 'upload' ingests
+                if not entry.is_file():
+                    continue
+                suffix = os.path.splitext(entry.name)[1].lower()
+                if suffix == ".pdf":
+                    pdf_files.append(entry.name)
+                elif suffix == ".txt":
+                    txt_files.append(entry.name)
         
         return {
             'exists': True,
-            'pdf_files': [f.name for f in pdf_files],
-            'txt_files': [f.name for f in txt_files],
+            'pdf_files': pdf_files,
+            'txt_files': txt_files,
             'total_files': len(pdf_files) + len(txt_files)
         }
\ No newline at end of file
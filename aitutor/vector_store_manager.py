@@ -1,5 +1,14 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import os
+import threading
 import random
+import uuid
+import hashlib
+from functools import lru_cache
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+import numpy as np
+import chromadb
 from langchain_mistralai.embeddings import MistralAIEmbeddings
 from langchain_chroma import Chroma
 from langchain.memory.vectorstore import VectorStoreRetrieverMemory
@@ -8,40 +17,194 @@ from langchain.docstore.document import Document
 class VectorStoreManager:
     """Manages vector stores for memory and knowledge base."""
 
-    def __init__(self, api_key: str, memory_dir: str, kb_dir: str):
+    def __init__(self, api_key: str, memory_dir: str, kb_dir: str,
+                 memory_k: int = 5, knowledge_k: int = 3,
+                 knowledge_fetch_k: int = 20, mmr_lambda: float = 0.5,
+                 memory_search_ef: Optional[int] = None,
+                 knowledge_search_ef: Optional[int] = None,
+                 embedding_batch_size: int = 64, embedding_workers: int = 4,
+                 embedding_cache_size: int = 1024,
+                 memory_min_relevance: float = 0.0,
+                 knowledge_min_relevance: float = 0.0,
+                 knowledge_cache_size: int = 256):
         self.embedding = MistralAIEmbeddings(api_key=api_key)
+        # Repeated query texts (retries, quiz answers, cache misses on new history) skip the embedding API
+        self._cached_query_embedding = lru_cache(maxsize=embedding_cache_size)(self._embed_query_uncached)
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_workers = embedding_workers
+        self.memory_k = memory_k
+        self.knowledge_k = knowledge_k
+        self.knowledge_fetch_k = knowledge_fetch_k
+        self.mmr_lambda = mmr_lambda
+        self.memory_min_relevance = memory_min_relevance
+        self.knowledge_min_relevance = knowledge_min_relevance
+
+        # Knowledge chunk texts for quiz sampling, loaded from Chroma on first use
+        self._chunk_texts: Optional[List[str]] = None
+
+        # Retrieved knowledge per (query vector, budget, kb_version); any add or reset changes
+        # kb_version, so entries from an older knowledge base can never be served
+        self.knowledge_cache_size = knowledge_cache_size
+        self._knowledge_cache = OrderedDict()
+        self._knowledge_cache_lock = threading.Lock()
+
+        # A single worker keeps memory writes in order while taking them off the response path
+        self._memory_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-writer")
+        self._pending_writes: List[Future] = []
+
+        # Open one persistent client per storage directory; when both stores
+        # point at the same directory they share a single client
+        memory_client = chromadb.PersistentClient(path=memory_dir)
+        if os.path.abspath(kb_dir) == os.path.abspath(memory_dir):
+            kb_client = memory_client
+        else:
+            kb_client = chromadb.PersistentClient(path=kb_dir)
 
         # Initialize vector stores
         self.memory_vectorstore = Chroma(
+            client=memory_client,
             collection_name="long_term_memory",
-            embedding_function=self.embedding,
-            persist_directory=memory_dir
+            embedding_function=self.embedding
         )
 
         self.knowledge_vectorstore = Chroma(
+            client=kb_client,
             collection_name="knowledge_base",
-            embedding_function=self.embedding,
-            persist_directory=kb_dir
+            embedding_function=self.embedding
         )
 
+        # Fingerprint of the knowledge base contents, persisted implicitly by the chunk ids
+        self._kb_fingerprint = self._fold_ids(0, self.knowledge_vectorstore._collection.get(include=[])["ids"])
+
+        self.memory_search_ef = memory_search_ef
+        # Keep this at or above knowledge_fetch_k so MMR still gets a full candidate pool
+        self.knowledge_search_ef = max(knowledge_search_ef, knowledge_fetch_k) if knowledge_search_ef else None
+        self._apply_search_ef()
+
         # Initialize retrievers
         self.memory = VectorStoreRetrieverMemory(
-            retriever=self.memory_vectorstore.as_retriever(search_kwargs={"k": 5})
+            retriever=self.memory_vectorstore.as_retriever(search_kwargs={"k": memory_k})
         )
-        self.knowledge_retriever = self.knowledge_vectorstore.as_retriever(search_kwargs={"k": 3})
+        self.knowledge_retriever = self.knowledge_vectorstore.as_retriever(search_kwargs={"k": knowledge_k})
+
+    def _apply_search_ef(self):
+        """Apply the configured HNSW search breadths to both collections."""
+        if self.memory_search_ef:
+            self._set_search_ef(self.memory_vectorstore, self.memory_search_ef)
+        if self.knowledge_search_ef:
+            self._set_search_ef(self.knowledge_vectorstore, self.knowledge_search_ef)
+
+    @staticmethod
+    def _set_search_ef(vectorstore: Chroma, search_ef: int):
+        """Narrow the HNSW search breadth of an existing collection for small-k lookups."""
+        collection = vectorstore._collection
+        # The index reads ef_search from the collection configuration; "hnsw:search_ef"
+        # metadata is only honoured when the collection is first created
+        hnsw = (collection.configuration or {}).get("hnsw") or {}
+        if hnsw.get("ef_search") == search_ef:
+            return
+        try:
+            collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+        except Exception as e:
+            print(f"⚠️ Could not set HNSW ef_search on {collection.name}: {str(e)}")
 
     def reset_collections(self):
         """Reset both memory and knowledge collections."""
-        # self.memory_vectorstore.delete_collection() # Use this if reset() is unavailable
-        # self.knowledge_vectorstore.delete_collection() # Use this if reset() is unavailable
-        # print("🧹 Chroma memory and knowledge base have been reset.")
-        pass
+        # Let queued memory writes land first so none of them recreate old entries afterwards
+        self.flush_pending_writes()
+        self.memory_vectorstore.reset_collection()
+        self.knowledge_vectorstore.reset_collection()
+        # The collections are recreated with default metadata
+        self._apply_search_ef()
+        self._chunk_texts = []
+        self._bump_kb_version(None)
+        print("🧹 Chroma memory and knowledge base have been reset.")
+
+
+    @staticmethod
+    def _content_id(text: str) -> str:
+        """Derive a stable chunk ID from its normalized content."""
+        return hashlib.sha256(text.strip().lower().encode("utf-8")).hexdigest()
+
+    def _embed_in_batches(self, texts: List[str]) -> Iterator[Tuple[int, List[List[float]]]]:
+        """Embed texts in fixed-size batches, yielding (offset, vectors) in order as each batch finishes."""
+        starts = range(0, len(texts), self.embedding_batch_size)
+        if len(starts) == 1:
+            yield 0, self.embedding.embed_documents(texts)
+            return
+
+        # map() yields in submission order while later batches are still in flight,
+        # so the caller can store each batch as soon as its vectors arrive
+        with ThreadPoolExecutor(max_workers=self.embedding_workers) as executor:
+            results = executor.map(
+                self.embedding.embed_documents,
+                (texts[start:start + self.embedding_batch_size] for start in starts)
+            )
+            yield from zip(starts, results)
+
+    def _bulk_add_to_knowledge_base(self, ids: List[str], documents: List[Document]):
+        """Embed documents outside Chroma and write them with direct collection adds."""
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+
+        # Chroma rejects adds larger than the client's max batch size
+        collection = self.knowledge_vectorstore._collection
+        max_batch_size = self.knowledge_vectorstore._client.get_max_batch_size()
+        # Write each embedded batch while the next ones are still being embedded,
+        # so the local Chroma writes overlap the network round-trips
+        for offset, embeddings in self._embed_in_batches(texts):
+            for start in range(0, len(embeddings), max_batch_size):
+                lo = offset + start
+                hi = lo + min(max_batch_size, len(embeddings) - start)
+                collection.add(
+                    ids=ids[lo:hi],
+                    embeddings=embeddings[start:start + max_batch_size],
+                    documents=texts[lo:hi],
+                    metadatas=metadatas[lo:hi]
+                )
+                # Per batch, so chunks written before a later failure still change the version
+                self._bump_kb_version(ids[lo:hi])
 
+        if self._chunk_texts is not None:
+            self._chunk_texts.extend(texts)
+
+    @property
+    def kb_version(self) -> str:
+        """Fingerprint of the knowledge base contents; the same chunks give the same value across restarts."""
+        return f"{self._kb_fingerprint:064x}"
+
+    @staticmethod
+    def _fold_ids(fingerprint: int, ids: List[str]) -> int:
+        """XOR chunk ids into a fingerprint, so it is independent of insertion order."""
+        for doc_id in ids:
+            fingerprint ^= int(hashlib.sha256(doc_id.encode("utf-8")).hexdigest(), 16)
+        return fingerprint
+
+    def _bump_kb_version(self, added_ids: Optional[List[str]]):
+        """Update the fingerprint after chunks are added (or the base is reset, with None)."""
+        with self._knowledge_cache_lock:
+            self._kb_fingerprint = 0 if added_ids is None else self._fold_ids(self._kb_fingerprint, added_ids)
+            self._knowledge_cache.clear()
 
     def add_documents_to_knowledge_base(self, documents: List[Document]) -> bool:
         """Add documents to the knowledge base."""
         try:
-            self.knowledge_vectorstore.add_documents(documents)
+            # Drop duplicate chunks (repeated headers/footers, re-uploads) before embedding
+            unique_docs = {}
+            for doc in documents:
+                unique_docs.setdefault(self._content_id(doc.page_content), doc)
+
+            if unique_docs:
+                existing = self.knowledge_vectorstore.get(ids=list(unique_docs), include=[])
+                for doc_id in existing.get('ids', []):
+                    unique_docs.pop(doc_id, None)
+
+            skipped = len(documents) - len(unique_docs)
+            if skipped:
+                print(f"♻️ Skipped {skipped} duplicate chunk(s) already in the knowledge base")
+
+            if unique_docs:
+                self._bulk_add_to_knowledge_base(list(unique_docs), list(unique_docs.values()))
             return True
         except Exception as e:
             print(f"❌ Error adding documents to knowledge base: {str(e)}")
@@ -50,17 +213,17 @@ class VectorStoreManager:
     def get_knowledge_base_status(self) -> Dict[str, Any]:
         """Get status information about the knowledge base."""
         try:
-            collection = self.knowledge_vectorstore.get(include=["metadatas"])
-            doc_count = len(collection['ids']) if collection and collection.get('ids') else 0
+            collection = self.knowledge_vectorstore._collection
+            doc_count = collection.count()
 
-            # Count file types
+            # Count file types in one pass over the stored metadata
             file_types = {}
             if doc_count > 0:
-                metadatas = collection.get('metadatas', [])
-                for metadata in metadatas:
-                    if metadata and 'file_type' in metadata:
-                        file_type = metadata['file_type']
-                        file_types[file_type] = file_types.get(file_type, 0) + 1
+                metadatas = collection.get(include=["metadatas"]).get('metadatas') or []
+                file_types = dict(Counter(
+                    metadata['file_type'] for metadata in metadatas
+                    if metadata and 'file_type' in metadata
+                ))
 
             return {
                 'total_chunks': doc_count,
@@ -75,11 +238,17 @@ class VectorStoreManager:
                 'error': str(e)
             }
 
+    def _load_chunk_texts(self) -> List[str]:
+        """Read every chunk once, then serve samples from memory instead of re-reading per question."""
+        if self._chunk_texts is None:
+            collection = self.knowledge_vectorstore.get(include=["documents"])
+            self._chunk_texts = list(collection.get("documents") or [])
+        return self._chunk_texts
+
     def get_random_knowledge_chunks(self, num_chunks: int = 1) -> List[str]:
         """Retrieve random document chunks from the knowledge base."""
         try:
-            collection = self.knowledge_vectorstore.get(include=["documents"])
-            documents = collection.get("documents")
+            documents = self._load_chunk_texts()
 
             if not documents or len(documents) < num_chunks:
                 return []
@@ -90,19 +259,199 @@ class VectorStoreManager:
             return []
 
 
-    def save_memory_context(self, input_text: str, output_text: str):
-        """Save conversation context to memory."""
-        self.memory.save_context(
-            {"input": input_text},
-            {"output": output_text}
+    def shuffle_knowledge_chunks(self, max_chunks: int) -> List[str]:
+        """Return up to max_chunks distinct chunks in random order."""
+        try:
+            documents = self._load_chunk_texts()
+            return random.sample(documents, min(max_chunks, len(documents)))
+        except Exception as e:
+            print(f"❌ Error retrieving random chunks: {str(e)}")
+            return []
+
+    def _embed_query_uncached(self, text: str) -> tuple:
+        # Stored as a tuple so cached vectors can't be mutated by callers
+        return tuple(self.embedding.embed_query(text))
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query once so the vector can be reused across lookups."""
+        return list(self._cached_query_embedding(text))
+
+    def lookup_cached_response(self, query_embedding: List[float], threshold: float,
+                               kb_version: str) -> Optional[str]:
+        """Return a stored answer whose question is semantically close enough to the query."""
+        try:
+            # Only answers given against the current knowledge base contents are reusable
+            results = self.memory_vectorstore.similarity_search_by_vector_with_relevance_scores(
+                query_embedding, k=1,
+                filter={"$and": [{"embedding_cached": True}, {"kb_version": kb_version}]}
+            )
+        except Exception as e:
+            print(f"❌ Error looking up semantic cache: {str(e)}")
+            return None
+
+        if not results:
+            return None
+
+        doc, distance = results[0]
+        score = self.memory_vectorstore._select_relevance_score_fn()(distance)
+        if score < threshold:
+            return None
+
+        # Entries are stored in the same "input: ...\noutput: ..." layout as VectorStoreRetrieverMemory
+        _, sep, answer = doc.page_content.partition("\noutput: ")
+        return answer if sep else None
+
+    def save_memory_context(self, input_text: str, output_text: str, query_embedding: Optional[List[float]] = None,
+                            kb_version: Optional[str] = None):
+        """Save conversation context to memory, as a semantic cache entry when kb_version is given."""
+        if query_embedding is None:
+            self.memory.save_context(
+                {"input": input_text},
+                {"output": output_text}
+            )
+            return
+
+        # Index the entry by its question; tagged with the knowledge base it was answered from,
+        # it doubles as a semantic cache entry
+        self.memory_vectorstore._collection.add(
+            ids=[str(uuid.uuid4())],
+            embeddings=[query_embedding],
+            documents=[f"input: {input_text}\noutput: {output_text}"],
+            metadatas=[{"embedding_cached": True, "kb_version": kb_version}] if kb_version else None
         )
 
+    def save_memory_context_async(self, input_text: str, output_text: str,
+                                  query_embedding: Optional[List[float]] = None,
+                                  kb_version: Optional[str] = None) -> Future:
+        """Queue a memory write in the background and return immediately."""
+        future = self._memory_writer.submit(
+            self.save_memory_context, input_text, output_text, query_embedding, kb_version
+        )
+        future.add_done_callback(self._report_write_error)
+        self._pending_writes = [f for f in self._pending_writes if not f.done()] + [future]
+        return future
+
+    @staticmethod
+    def _report_write_error(future: Future):
+        """Surface errors from background memory writes."""
+        error = future.exception()
+        if error is not None:
+            print(f"❌ Error saving memory context: {str(error)}")
+
+    def flush_pending_writes(self):
+        """Block until all queued memory writes have finished."""
+        wait(self._pending_writes)
+        self._pending_writes = []
+
     def load_memory_variables(self, input_text: str) -> str:
         """Load relevant memory for given input."""
         memory_result = self.memory.load_memory_variables({"input": input_text})
         return memory_result.get("history", "")
 
+    @staticmethod
+    def _join_within_budget(docs: List[Document], token_budget: Optional[int]) -> str:
+        """Join retrieved docs in rank order, stopping once the token budget is spent."""
+        if token_budget is None:
+            return "\n".join(doc.page_content for doc in docs)
+
+        # Cheap estimate of ~4 characters per token keeps this O(budget)
+        remaining_chars = token_budget * 4
+        parts = []
+        for doc in docs:
+            if remaining_chars <= 0:
+                break
+            text = doc.page_content[:remaining_chars]
+            parts.append(text)
+            remaining_chars -= len(text)
+        return "\n".join(parts)
+
+    def load_memory_by_vector(self, query_embedding: List[float], token_budget: Optional[int] = None) -> str:
+        """Load relevant memory for a pre-computed query embedding."""
+        if not self.memory_min_relevance:
+            docs = self.memory_vectorstore.similarity_search_by_vector(query_embedding, k=self.memory_k)
+            return self._join_within_budget(docs, token_budget)
+
+        # Results come back as raw distances, nearest first
+        results = self.memory_vectorstore.similarity_search_by_vector_with_relevance_scores(
+            query_embedding, k=self.memory_k
+        )
+        relevance = self.memory_vectorstore._select_relevance_score_fn()
+        docs = [doc for doc, distance in results if relevance(distance) >= self.memory_min_relevance]
+        return self._join_within_budget(docs, token_budget)
+
     def retrieve_knowledge(self, query: str) -> str:
         """Retrieve relevant knowledge for given query."""
         docs = self.knowledge_retriever.invoke(query)
-        return "\n".join(doc.page_content for doc in docs)
\ No newline at end of file
+        return "\n".join(doc.page_content for doc in docs)
+
+    def _mmr_search_by_vector(self, query_embedding: List[float], k: int) -> List[Document]:
+        """Select diverse, relevant knowledge chunks with maximal marginal relevance."""
+        results = self.knowledge_vectorstore._collection.query(
+            query_embeddings=[query_embedding],
+            n_results=self.knowledge_fetch_k,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        texts = results["documents"][0] if results.get("documents") else []
+        if not texts:
+            return []
+        metadatas = results["metadatas"][0]
+
+        # Normalize once so every similarity below is a single matrix product
+        candidates = np.asarray(results["embeddings"][0], dtype=np.float32)
+        candidates /= np.linalg.norm(candidates, axis=1, keepdims=True) + 1e-10
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-10
+        query_sim = candidates @ query
+
+        # Off-topic chunks are dropped before MMR so diversity never pulls them in
+        if self.knowledge_min_relevance:
+            keep = np.flatnonzero(query_sim >= self.knowledge_min_relevance)
+            if not len(keep):
+                return []
+            candidates, query_sim = candidates[keep], query_sim[keep]
+            texts = [texts[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+
+        pairwise_sim = candidates @ candidates.T
+
+        first = int(np.argmax(query_sim))
+        selected = [first]
+        available = np.ones(len(texts), dtype=bool)
+        available[first] = False
+        # Running max similarity of each candidate to the already selected set
+        redundancy = pairwise_sim[:, first].copy()
+
+        while len(selected) < min(k, len(texts)):
+            scores = self.mmr_lambda * query_sim - (1 - self.mmr_lambda) * redundancy
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            available[best] = False
+            np.maximum(redundancy, pairwise_sim[:, best], out=redundancy)
+
+        return [Document(page_content=texts[i], metadata=metadatas[i] or {}) for i in selected]
+
+    def retrieve_knowledge_by_vector(self, query_embedding: List[float], token_budget: Optional[int] = None) -> str:
+        """Retrieve relevant knowledge for a pre-computed query embedding."""
+        if self.knowledge_cache_size <= 0:
+            docs = self._mmr_search_by_vector(query_embedding, k=self.knowledge_k)
+            return self._join_within_budget(docs, token_budget)
+
+        # Read the version before searching so a concurrent upload can't be cached under the new one
+        kb_version = self.kb_version
+        digest = hashlib.sha256(np.asarray(query_embedding, dtype=np.float32).tobytes()).hexdigest()
+        key = (digest, token_budget, kb_version)
+        with self._knowledge_cache_lock:
+            if key in self._knowledge_cache:
+                self._knowledge_cache.move_to_end(key)
+                return self._knowledge_cache[key]
+
+        docs = self._mmr_search_by_vector(query_embedding, k=self.knowledge_k)
+        knowledge = self._join_within_budget(docs, token_budget)
+
+        with self._knowledge_cache_lock:
+            if kb_version == self.kb_version:
+                self._knowledge_cache[key] = knowledge
+                if len(self._knowledge_cache) > self.knowledge_cache_size:
+                    self._knowledge_cache.popitem(last=False)
+        return knowledge
\ No newline at end of file